@@ -11,23 +11,55 @@ NOTA: Esta é uma versão sanitizada para uso público/educacional.
 
 import os
 import re
-import shutil
+import csv
+import sys
+import queue
 import zipfile
+import tempfile
+import threading
 import unicodedata
 from pathlib import Path
+from itertools import repeat
+from functools import lru_cache
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from PyPDF2 import PdfReader, PdfWriter
 
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasick é opcional
+    ahocorasick = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # pypdfium2 é opcional
+    pdfium = None
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:  # PyMuPDF é opcional
+    fitz = None
+
 # --- CONFIGURAÇÃO ---
 PASTA_ENTRADA = "entrada"
 PASTA_SAIDA = "saida"
-TEMP_PARTS = "temp_parts"
 ZIP_FINAL = "comprovantes_renomeados.zip"
 LOG_CSV = "renomeacao_log.csv"
 DEBUG_LOG = "debug_extracao.txt"
+# Também gravar os PDFs renomeados em PASTA_SAIDA (o ZIP é sempre gerado)
+GRAVAR_PASTA_SAIDA = True
 MAX_NAME_LEN = 60
 BARCODE_TAIL_LEN = 6
 PIX_PREFIX = "N"
+# Extrator de texto: "pypdf2" (padrão), "pdfium" (requer pypdfium2) ou
+# "pymupdf" (requer PyMuPDF); os dois últimos rodam em código nativo.
+# A gravação das páginas continua sempre com PyPDF2.
+EXTRATOR_TEXTO = "pypdf2"
+# Modo estrito: avalia todos os padrões de beneficiário antes de decidir
+# (também ativado com --strict na linha de comando)
+MODO_ESTRITO = False
+# Campos de diagnóstico e DEBUG_LOG só são gerados com RC_DEBUG=1 (ou true/sim/yes)
+DEBUG = os.environ.get("RC_DEBUG", "").strip().lower() in ("1", "true", "sim", "yes")
 
 # CONFIGURAÇÃO: Defina suas empresas/divisões aqui
 EMPRESAS = {
@@ -36,6 +68,137 @@ EMPRESAS = {
     "DIVISION_C": ["COMPANY C LEGAL NAME", "COMPANY C TRADING NAME"]
 }
 
+# CONFIGURAÇÃO: Adicione nomes de empresas do sistema para rejeitar
+EMPRESAS_SISTEMA = ('SYSTEM_BANK', 'YOUR_COMPANY')
+
+# --- REGEX PRÉ-COMPILADAS ---
+# Tudo fora do conjunto permitido (inclui os caracteres proibidos \/:*?"<>|)
+_SANITIZE_RE = re.compile(r"[^0-9A-Za-z_\-\s\(\)\[\]]+")
+_ALPHA_RE = re.compile(r'[a-zA-Z]')
+_WORD5_RE = re.compile(r'[a-zA-Z]{5,}')
+
+# Palavras que, sozinhas ou no início, indicam rótulo e não nome
+_REJEITAR = (
+    'agencia', 'conta', 'cpf', 'cnpj', 'chave', 'instituicao',
+    'banco', 'dados', 'transferencia', 'pagamento', 'valor',
+    'documento', 'autenticacao', 'controle', 'debito', 'origem'
+)
+_REJEITAR_EXATO = frozenset(_REJEITAR)
+_REJEITAR_PREFIXO_RE = re.compile(r'(?:' + '|'.join(_REJEITAR) + r') ')
+
+if ahocorasick is not None and EMPRESAS_SISTEMA:
+    _SISTEMA_AC = ahocorasick.Automaton()
+    for _emp in EMPRESAS_SISTEMA:
+        _SISTEMA_AC.add_word(_emp, _emp)
+    _SISTEMA_AC.make_automaton()
+else:
+    _SISTEMA_AC = None
+
+_LIGADURAS_MAP = str.maketrans({"\ufb01": "fi", "\ufb02": "fl", "\u2028": " "})
+
+# Acentos latinos comuns -> letra base (mesmo resultado de NFKD + remoção de combinantes)
+_DIACRITICOS_MAP = str.maketrans({
+    c: unicodedata.normalize("NFKD", c)[0]
+    for c in "ÀÁÂÃÄÅàáâãäåÇçÈÉÊËèéêëÌÍÎÏìíîïÑñÒÓÔÕÖòóôõöÙÚÛÜùúûüÝýÿ"
+})
+
+# Uma única alternação (em ordem de prioridade): o grupo nomeado que casou
+# identifica o tipo do valor, com uma só passada sobre o texto.
+_VALOR_RE = re.compile(
+    r"(?:Valor\s+principal[:\s]*R?\$?\s*(?P<principal>[\d\.,]+))"
+    r"|(?:Valor\s+total\s+pago[:\s]*R?\$?\s*(?P<total_pago>[\d\.,]+))"
+    r"|(?:Valor\s+do\s+pagamento[:\s]*R?\$?\s*(?P<pagamento>[\d\.,]+))"
+    r"|(?:Valor\s+total[:\s]*R?\$?\s*(?P<total>[\d\.,]+))"
+    r"|(?:(?:^|\n)Valor[:\s]*R?\$?\s*(?P<valor_linha>[\d\.,]+))"
+    r"|(?:R\$\s*(?P<rs_isolado>[\d\.,]+))",
+    re.IGNORECASE
+)
+_VALOR_PRIORIDADE = {
+    "principal": 1,
+    "total_pago": 1,
+    "pagamento": 2,
+    "total": 3,
+    "valor_linha": 4,
+    "rs_isolado": 5,
+}
+# Desempate entre prioridades iguais: ordem do padrão, como na antiga busca
+# padrão a padrão (principal antes de total_pago)
+_VALOR_CHAVE = {tipo: (prio, i) for i, (tipo, prio) in enumerate(_VALOR_PRIORIDADE.items())}
+
+# Padrões de beneficiário numa única alternação, dentro de um lookahead para
+# que o finditer visite toda posição: a primeira ocorrência de cada grupo é a
+# mesma que um re.search isolado daquele padrão encontraria. O (?=[CRF])
+# inicial deixa o motor pular direto para as letras que iniciam algum padrão.
+# Roda sobre o texto com espaços colapsados.
+_BENEF_RE = re.compile(
+    r'(?=[CRF])'
+    # PADRÃO: Controle de Pagamento (Bradesco PIX novo)
+    r'(?=Controle\s+de\s+Pagamento\s+Benefici[aá]rio:\s*(?P<controle>[A-ZÀ-ÚÇ][A-ZÀ-ÚÇ\s\.\-\(\)0-9]+?)(?:\s*CPF/CNPJ:|\s*Controle:|\s*$)'
+    # PADRÃO: TED - Crédito Nome
+    r'|Crédito:\s*Nome:\s*(?P<ted>[A-Z][A-Z\s\.\-]{5,100}?)(?:\s*CPF/CNPJ|\s*Agência|$)'
+    # PADRÃO: BOLETO - Razão Social Beneficiário
+    r'|Razão\s+Social\s+Beneficiário[:\s]+(?P<boleto>[A-Z][A-Z\s]+?)(?:\s*(?:CPF|CNPJ|Nome|\d{3}\.\d{3}))'
+    # PADRÃO: Favorecido
+    r'|Favorecido[:\s]+(?P<fav>[A-Z][A-Z\s]+?)(?:\s+Valor|\s+CNPJ|\s+CPF))',
+    re.IGNORECASE | re.DOTALL
+)
+
+# PADRÃO: PIX - Dados de quem recebeu. Roda sobre o texto original, não o
+# colapsado: o limite {5,100} do nome conta quebras e espaços repetidos, e o
+# $ casa antes da quebra final. O trecho até "Nome" não atravessa outro
+# cabeçalho: cada início varre só até o próximo, mantendo a busca linear sem
+# mudar o nome capturado.
+_PIX_RE = re.compile(
+    r'(?:Dados de quem recebeu|Destinatário)(?:(?!Dados de quem recebeu|Destinatário).)*?'
+    r'Nome\s*:\s*(?P<pix>[A-Z][A-Z\s\.\-]{5,100}?)(?:\s*CPF/CNPJ|\s*Instituição|$)',
+    re.IGNORECASE | re.DOTALL
+)
+
+# Aliases de empresa: (ordem, chave) para preservar a precedência de EMPRESAS
+_EMPRESA_ALIASES = tuple(
+    (a.upper(), ordem, key)
+    for ordem, (key, aliases) in enumerate(EMPRESAS.items())
+    for a in aliases
+)
+if ahocorasick is not None and _EMPRESA_ALIASES:
+    _EMPRESA_AC = ahocorasick.Automaton()
+    for _alias, _ordem, _key in _EMPRESA_ALIASES:
+        _EMPRESA_AC.add_word(_alias, (_ordem, _key))
+    _EMPRESA_AC.make_automaton()
+else:
+    _EMPRESA_AC = None
+
+# Grupos de _BENEF_RE e _PIX_RE em ordem decrescente de score:
+# grupo -> (score, método, min_len, tipo, normalizar nome)
+_BENEF_PATTERNS = {
+    'controle': (22, 'BRADESCO-PIX-Controle', 5, 'BRADESCO-PIX', True),
+    'ted': (19, 'TED', 5, None, True),
+    'pix': (15, 'PIX-recebedor', 8, 'PIX', True),
+    'boleto': (10, 'BOLETO-razao-social', 8, 'BOLETO', False),
+    'fav': (10, 'Favorecido', 5, None, False),
+}
+_BENEF_MELHOR = next(iter(_BENEF_PATTERNS))
+# Grupos que, achados fora do modo estrito, dispensam a busca de PIX
+_BENEF_ACIMA_PIX = tuple(_BENEF_PATTERNS)[:tuple(_BENEF_PATTERNS).index('pix')]
+
+# Cabeçalho literal (maiúsculo, espaços colapsados) sem o qual o grupo não casa
+_BENEF_ANCORAS = {
+    'controle': ('CONTROLE DE PAGAMENTO BENEFICI',),
+    'ted': ('CRÉDITO:',),
+    'pix': ('DADOS DE QUEM RECEBEU', 'DESTINATÁRIO'),
+    'boleto': ('RAZÃO SOCIAL BENEFICIÁRIO',),
+    'fav': ('FAVORECIDO',),
+}
+
+# Sequência de 20 a 60 dígitos, tolerando espaços/quebras entre eles
+_DIGIT_RUN_RE = re.compile(r'(?:[0-9]\s*){20,60}')
+# Marcador e sequência de dígitos numa só alternação (uma passada por página)
+_BARCODE_RE = re.compile(
+    r"(?P<marcador>LINHA\s+DIGIT|CODIGO\s+DE\s+BARRAS)"
+    r"|(?P<digitos>" + _DIGIT_RUN_RE.pattern + r")",
+    re.IGNORECASE
+)
+
 # --- HELPERS ---
 def safe_makedirs(path):
     if not os.path.exists(path):
@@ -44,375 +207,558 @@ def safe_makedirs(path):
 def limpar_texto(texto: str) -> str:
     if not texto:
         return ""
-    texto = texto.replace("\ufb01", "fi").replace("\ufb02", "fl").replace("\u2028", " ")
-    texto = unicodedata.normalize("NFKC", texto)
-    return texto
-
+    # Ligaduras e U+2028 não são ASCII: texto ASCII já está limpo
+    if texto.isascii():
+        return texto
+    texto = texto.translate(_LIGADURAS_MAP)
+    return unicodedata.normalize("NFKC", texto)
+
+# Beneficiários se repetem muito no mesmo lote: memoiza a limpeza do nome
+@lru_cache(maxsize=4096)
 def sanitize_filename(name: str) -> str:
     name = (name or "").strip()
-    name = unicodedata.normalize("NFKD", name)
-    name = "".join(c for c in name if not unicodedata.combining(c))
-    name = re.sub(r'[\\/\:*?"<>|]', "", name)
-    name = re.sub(r"[^0-9A-Za-z_\-\s\(\)\[\]]", "", name)
+    name = name.translate(_DIACRITICOS_MAP)
+    if not name.isascii():
+        # O que não vira ASCII seria removido por _SANITIZE_RE de qualquer forma;
+        # só os espaços Unicode precisam sobreviver como separadores
+        name = unicodedata.normalize("NFKD", " ".join(name.split()))
+        name = name.encode("ascii", "ignore").decode("ascii")
+    name = _SANITIZE_RE.sub("", name)
     name = "_".join(name.split())
     if len(name) > MAX_NAME_LEN:
         name = name[:MAX_NAME_LEN]
     return name or "FORNECEDOR_DESCONHECIDO"
 
+def _norm_name(nome: str) -> str:
+    """Colapsa espaços e converte para maiúsculas em uma única etapa"""
+    return ' '.join(nome.split()).upper()
+
 def validar_nome(nome: str, min_len: int = 5) -> bool:
     """Valida se string parece um nome válido"""
     if not nome or len(nome) < min_len:
         return False
 
-    if not re.search(r'[a-zA-Z]', nome):
+    # Sem nenhuma letra também cobre os nomes só com dígitos/pontuação
+    if not _ALPHA_RE.search(nome):
         return False
 
-    if re.match(r'^[\d\.\-\*\s]+$', nome):
-        return False
-
-    # CONFIGURAÇÃO: Adicione nomes de empresas do sistema para rejeitar
-    empresas_sistema = ['SYSTEM_BANK', 'YOUR_COMPANY']
     nome_upper = nome.upper()
-    for emp in empresas_sistema:
-        if emp in nome_upper:
+    if _SISTEMA_AC is not None:
+        if next(_SISTEMA_AC.iter(nome_upper), None) is not None:
             return False
-
-    rejeitar = [
-        'agencia', 'conta', 'cpf', 'cnpj', 'chave', 'instituicao',
-        'banco', 'dados', 'transferencia', 'pagamento', 'valor',
-        'documento', 'autenticacao', 'controle', 'debito', 'origem'
-    ]
+    elif any(emp in nome_upper for emp in EMPRESAS_SISTEMA):
+        return False
 
     nome_lower = nome.lower()
-    for r in rejeitar:
-        if nome_lower == r or nome_lower.startswith(r + ' '):
-            return False
+    if nome_lower in _REJEITAR_EXATO or _REJEITAR_PREFIXO_RE.match(nome_lower):
+        return False
 
     palavras = nome.split()
-    if len(palavras) >= 2 or len(re.findall(r'[a-zA-Z]{5,}', nome)) > 0:
+    if len(palavras) >= 2 or _WORD5_RE.search(nome):
         return True
 
     return False
 
 # --- FUNÇÕES DE EXTRAÇÃO ---
-def extrair_texto_pdf(path: str, debug_info: dict) -> str:
-    """Extrai texto usando PyPDF2"""
+def abrir_extrator_nativo(path: str):
+    """Abre o PDF no extrator nativo configurado; None usa PyPDF2"""
+    try:
+        if EXTRATOR_TEXTO == "pdfium" and pdfium is not None:
+            return pdfium.PdfDocument(path)
+        if EXTRATOR_TEXTO == "pymupdf" and fitz is not None:
+            return fitz.open(path)
+    except Exception:
+        pass
+    return None
+
+def extrair_texto_pagina(page, debug_info: dict, doc_nativo=None, indice: int = 0) -> str:
+    """Extrai texto de uma página já carregada (extrator nativo ou PyPDF2)"""
+    if doc_nativo is not None:
+        try:
+            if EXTRATOR_TEXTO == "pymupdf":
+                t = doc_nativo[indice].get_text("text")
+            else:
+                t = doc_nativo[indice].get_textpage().get_text_range()
+            if DEBUG:
+                debug_info['extrator'] = EXTRATOR_TEXTO
+            return limpar_texto(t + "\n" if t else "")
+        except Exception:
+            pass
+
     texto = ""
     try:
-        with open(path, 'rb') as f:
-            reader = PdfReader(f)
-            for p in reader.pages:
-                t = p.extract_text()
-                if t:
-                    texto += t + "\n"
+        t = page.extract_text()
+        if t:
+            texto = t + "\n"
     except Exception:
         pass
 
-    debug_info['extrator'] = 'PyPDF2'
+    if DEBUG:
+        debug_info['extrator'] = 'PyPDF2'
     return limpar_texto(texto)
 
-def separar_em_partes(orig_pdf: str, dest_folder: str):
-    """Separa PDF multi-página em arquivos individuais"""
-    novos = []
+def listar_paginas(orig_pdf: str):
+    """Lista as páginas de um PDF como (nome_parte, página), sem gravar em disco"""
     try:
         reader = PdfReader(orig_pdf)
-        total = len(reader.pages)
-        for i in range(total):
-            writer = PdfWriter()
-            writer.add_page(reader.pages[i])
-            stem = Path(orig_pdf).stem
-            novo_nome = f"{stem}_part{i+1}.pdf"
-            novo_path = os.path.join(dest_folder, novo_nome)
-            with open(novo_path, "wb") as f:
-                writer.write(f)
-            novos.append(novo_path)
+        stem = Path(orig_pdf).stem
+        return [(f"{stem}_part{i+1}.pdf", page) for i, page in enumerate(reader.pages)]
     except Exception as e:
         print(f"⚠️ Erro ao separar PDF: {e}")
-        novos.append(orig_pdf)
-    return novos
+        return []
+
+def gravar_pagina(page, pasta_tmp: str = None) -> str:
+    """Grava uma única página como PDF próprio num arquivo temporário e
+    retorna o caminho (assim o PDF não trafega nem fica em memória)"""
+    writer = PdfWriter()
+    writer.add_page(page)
+    fd, caminho = tempfile.mkstemp(suffix=".pdf", dir=pasta_tmp)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            writer.write(f)
+    except Exception:
+        os.remove(caminho)
+        raise
+    return caminho
+
+def normalizar_texto(texto: str) -> tuple:
+    """Retorna (texto com espaços colapsados, mesmo texto em maiúsculas)"""
+    texto = texto or ""
+    texto_clean = ' '.join(texto.split())
+    # Mantém um espaço nas pontas, como re.sub(r'\s+', ' '): os padrões que
+    # terminam em $ contam o espaço final no tamanho mínimo do nome
+    if not texto_clean:
+        texto_clean = ' ' if texto else ''
+    else:
+        if texto[0].isspace():
+            texto_clean = ' ' + texto_clean
+        if texto[-1].isspace():
+            texto_clean += ' '
+    return texto_clean, texto_clean.upper()
 
 def identificar_empresa(texto: str) -> str:
     """Identifica empresa pagadora baseado em aliases"""
     t = (texto or "").upper()
-    for key, aliases in EMPRESAS.items():
-        for a in aliases:
-            if a.upper() in t:
-                return key
+    if _EMPRESA_AC is not None:
+        # Uma passada só; vence a empresa declarada primeiro em EMPRESAS
+        achados = [v for _, v in _EMPRESA_AC.iter(t)]
+        return min(achados)[1] if achados else "OUTROS"
+    for a, _, key in _EMPRESA_ALIASES:
+        if a in t:
+            return key
     return "OUTROS"
 
 def extrair_valor(texto: str, debug_info: dict) -> str:
     """Extrai valor do pagamento com priorização por contexto"""
     if not texto:
-        debug_info['valor_erro'] = "Texto vazio"
+        if DEBUG:
+            debug_info['valor_erro'] = "Texto vazio"
         return "VALOR_NAO_ENCONTRADO"
 
-    valores_encontrados = []
-
-    patterns = [
-        (r"Valor\s+principal[:\s]*R?\$?\s*([\d\.,]+)", 1, "principal"),
-        (r"Valor\s+total\s+pago[:\s]*R?\$?\s*([\d\.,]+)", 1, "total_pago"),
-        (r"Valor\s+do\s+pagamento[:\s]*R?\$?\s*([\d\.,]+)", 2, "pagamento"),
-        (r"Valor\s+total[:\s]*R?\$?\s*([\d\.,]+)", 3, "total"),
-        (r"(?:^|\n)Valor[:\s]*R?\$?\s*([\d\.,]+)", 4, "valor_linha"),
-        (r"R\$\s*([\d\.,]+)", 5, "rs_isolado"),
-    ]
-
-    for pattern, prioridade, tipo in patterns:
-        for m in re.finditer(pattern, texto, re.IGNORECASE):
-            val = m.group(1).strip()
-            if "," in val and "." in val:
-                val = val.replace(".", "")
-            val_conv = val.replace(",", ".")
-            try:
-                valor_float = float(val_conv)
-                if valor_float > 0:
-                    valores_encontrados.append({
-                        'valor': val.replace(".", ","),
-                        'tipo': tipo,
-                        'prioridade': prioridade,
-                        'float': valor_float
-                    })
-            except:
-                continue
+    # Passada única: vence a menor (prioridade, ordem do padrão); no empate,
+    # a primeira ocorrência no texto
+    melhor = None
+    melhor_chave = None
+    for m in _VALOR_RE.finditer(texto):
+        tipo = m.lastgroup
+        val = m.group(tipo).strip()
+        if "," in val and "." in val:
+            val = val.replace(".", "")
+        try:
+            valor_float = float(val.replace(",", "."))
+        except ValueError:
+            continue
+        if valor_float <= 0:
+            continue
 
-    if valores_encontrados:
-        unicos = {}
-        for v in valores_encontrados:
-            if v['float'] not in unicos or v['prioridade'] < unicos[v['float']]['prioridade']:
-                unicos[v['float']] = v
+        chave = _VALOR_CHAVE[tipo]
+        if melhor_chave is None or chave < melhor_chave:
+            melhor_chave = chave
+            melhor = (tipo, val.replace(".", ","))
 
-        melhor = min(unicos.values(), key=lambda x: x['prioridade'])
-        debug_info['valor_selecionado'] = f"{melhor['tipo']}={melhor['valor']}"
-        return melhor['valor']
+    if melhor:
+        tipo, valor = melhor
+        if DEBUG:
+            debug_info['valor_selecionado'] = f"{tipo}={valor}"
+        return valor
 
-    debug_info['valor_erro'] = "Nenhum padrão"
+    if DEBUG:
+        debug_info['valor_erro'] = "Nenhum padrão"
     return "VALOR_NAO_ENCONTRADO"
 
-def extrair_beneficiario(texto: str, debug_info: dict) -> str:
-    """Extração de beneficiário com padrões multi-banco"""
+def _classificar_layout(texto_upper: str) -> tuple:
+    """Grupos de _BENEF_RE cujo cabeçalho aparece na página e a posição do
+    primeiro cabeçalho (busca literal com str.find, sem regex)"""
+    possiveis = []
+    inicio = len(texto_upper)
+    for grupo, ancoras in _BENEF_ANCORAS.items():
+        achou = False
+        for a in ancoras:
+            i = texto_upper.find(a)
+            if i >= 0:
+                achou = True
+                inicio = min(inicio, i)
+        if achou:
+            possiveis.append(grupo)
+    return tuple(possiveis), inicio
+
+def _candidato_benef(grupo: str, bruto: str):
+    """Nome capturado já normalizado, ou None se não passar na validação"""
+    _, _, min_len, _, normalizar = _BENEF_PATTERNS[grupo]
+    nome = _norm_name(bruto) if normalizar else bruto.strip()
+    return nome if validar_nome(nome, min_len=min_len) else None
+
+def extrair_beneficiario(texto: str, debug_info: dict, estrito: bool = False,
+                         normalizado: tuple = None) -> str:
+    """Extração de beneficiário com padrões multi-banco
+
+    Os padrões são testados em ordem decrescente de score; fora do modo
+    estrito o primeiro candidato válido já é o vencedor.
+    """
     if not texto:
-        debug_info['benef_erro'] = "Texto vazio"
+        if DEBUG:
+            debug_info['benef_erro'] = "Texto vazio"
         return "FORNECEDOR_DESCONHECIDO"
 
-    texto_clean = re.sub(r'\s+', ' ', texto)
-    candidatos = []
-
-    # PADRÃO: Controle de Pagamento (Bradesco PIX novo)
-    m_controle = re.search(
-        r'Controle\s+de\s+Pagamento\s+Benefici[aá]rio:\s*([A-ZÀ-ÚÇ][A-ZÀ-ÚÇ\s\.\-\(\)0-9]+?)(?:\s*CPF/CNPJ:|\s*Controle:|\s*$)',
-        texto_clean,
-        re.IGNORECASE
-    )
-    if m_controle:
-        nome = m_controle.group(1).strip()
-        nome = re.sub(r'\s+', ' ', nome).upper()
-        if validar_nome(nome, min_len=5):
-            candidatos.append({'nome': nome, 'score': 22, 'metodo': 'BRADESCO-PIX-Controle'})
-            debug_info['tipo'] = 'BRADESCO-PIX'
-
-    # PADRÃO: PIX - Dados de quem recebeu
-    m_pix = re.search(
-        r'(?:Dados de quem recebeu|Destinatário).*?Nome\s*:\s*([A-Z][A-Z\s\.\-]{5,100}?)(?:\s*CPF/CNPJ|\s*Instituição|$)',
-        texto,
-        re.IGNORECASE | re.DOTALL
-    )
-    if m_pix:
-        nome = m_pix.group(1).strip()
-        nome = re.sub(r'\s+', ' ', nome).upper()
-        if validar_nome(nome, min_len=8):
-            candidatos.append({'nome': nome, 'score': 15, 'metodo': 'PIX-recebedor'})
-            debug_info['tipo'] = 'PIX'
-
-    # PADRÃO: TED - Crédito Nome
-    m_ted = re.search(
-        r'Crédito:\s*Nome:\s*([A-Z][A-Z\s\.\-]{5,100}?)(?:\s*CPF/CNPJ|\s*Agência|$)',
-        texto_clean,
-        re.IGNORECASE | re.DOTALL
-    )
-    if m_ted:
-        nome = m_ted.group(1).strip()
-        nome = re.sub(r'\s+', ' ', nome).upper()
-        if validar_nome(nome, min_len=5):
-            candidatos.append({'nome': nome, 'score': 19, 'metodo': 'TED'})
-
-    # PADRÃO: BOLETO - Razão Social Beneficiário
-    m_boleto = re.search(
-        r'Razão\s+Social\s+Beneficiário[:\s]+([A-Z][A-Z\s]+?)(?:\s*(?:CPF|CNPJ|Nome|\d{3}\.\d{3}))',
-        texto_clean,
-        re.IGNORECASE
-    )
-    if m_boleto:
-        benef = m_boleto.group(1).strip()
-        if validar_nome(benef, min_len=8):
-            candidatos.append({'nome': benef, 'score': 10, 'metodo': 'BOLETO-razao-social'})
-            debug_info['tipo'] = 'BOLETO'
-
-    # PADRÃO: Favorecido
-    m_fav = re.search(
-        r'Favorecido[:\s]+([A-Z][A-Z\s]+?)(?:\s+Valor|\s+CNPJ|\s+CPF)',
-        texto_clean,
-        re.IGNORECASE
-    )
-    if m_fav:
-        fav = m_fav.group(1).strip()
-        if validar_nome(fav):
-            candidatos.append({'nome': fav, 'score': 10, 'metodo': 'Favorecido'})
-
-    # DECISÃO FINAL
-    if candidatos:
-        unicos = {}
-        for c in candidatos:
-            nome_norm = c['nome'].upper().strip()
-            if nome_norm not in unicos or c['score'] > unicos[nome_norm]['score']:
-                unicos[nome_norm] = c
-
-        melhor = max(unicos.values(), key=lambda x: x['score'])
-        debug_info['benef_metodo'] = melhor['metodo']
-        debug_info['benef_score'] = melhor['score']
-        debug_info['candidatos_total'] = len(candidatos)
-        return melhor['nome']
-
-    debug_info['benef_erro'] = "Nenhum candidato válido"
+    texto_clean, texto_upper = normalizado or normalizar_texto(texto)
+
+    # Layouts ausentes da página nem chegam ao regex
+    possiveis, inicio = _classificar_layout(texto_upper)
+    if len(texto_upper) != len(texto_clean):
+        # upper() mudou o comprimento (ex.: ß -> SS): posições não batem
+        inicio = 0
+
+    # Uma passada: guarda o primeiro nome válido de cada padrão
+    encontrados = {}
+    no_regex_unico = len(possiveis) - ('pix' in possiveis)
+    if no_regex_unico:
+        # O regex começa no primeiro cabeçalho, não no início da página
+        for m in _BENEF_RE.finditer(texto_clean, inicio):
+            grupo = m.lastgroup
+            if grupo in encontrados:
+                continue
+            encontrados[grupo] = _candidato_benef(grupo, m.group(grupo))
+            if len(encontrados) == no_regex_unico:
+                break
+            if grupo == _BENEF_MELHOR and encontrados[grupo] and not estrito:
+                break
+
+    # PIX no texto original, só se ainda puder vencer
+    if 'pix' in possiveis and (estrito or not any(encontrados.get(g) for g in _BENEF_ACIMA_PIX)):
+        m = _PIX_RE.search(texto)
+        if m:
+            encontrados['pix'] = _candidato_benef('pix', m.group('pix'))
+
+    # DECISÃO FINAL: os grupos estão em ordem decrescente de score, então o
+    # primeiro candidato válido é o vencedor; os demais só entram na contagem
+    melhor = None
+    total = 0
+    for grupo, (score, metodo, _, tipo, _) in _BENEF_PATTERNS.items():
+        nome = encontrados.get(grupo)
+        if not nome:
+            continue
+        total += 1
+        if tipo and DEBUG:
+            debug_info['tipo'] = tipo
+        if melhor is None:
+            melhor = (nome, score, metodo)
+        if not estrito:
+            break
+
+    if melhor:
+        nome, score, metodo = melhor
+        # Método e score também aparecem no console
+        debug_info['benef_metodo'] = metodo
+        debug_info['benef_score'] = score
+        if DEBUG:
+            debug_info['candidatos_total'] = total
+        return nome
+
+    if DEBUG:
+        debug_info['benef_erro'] = "Nenhum candidato válido"
     return "FORNECEDOR_DESCONHECIDO"
 
-def extrair_linha_digitavel(texto: str) -> str:
-    """Extrai código de barras ou linha digitável"""
-    if not texto:
+def extrair_snippet_barcode(texto: str) -> str:
+    """Final da linha digitável, só se a página tiver o marcador de boleto
+
+    Marcador e dígitos saem do mesmo finditer: como um não casa dentro do
+    outro, a primeira sequência encontrada é a mesma de _DIGIT_RUN_RE.search.
+    """
+    marcador = False
+    seq = None
+    for m in _BARCODE_RE.finditer(texto or ""):
+        if m.lastgroup == 'marcador':
+            marcador = True
+        elif seq is None:
+            seq = ''.join(m.group('digitos').split())
+        if marcador and seq is not None:
+            break
+    if not marcador or not seq:
         return ""
-    texto_limpo = re.sub(r'\s+', '', texto)
-    m = re.search(r'([0-9]{20,60})', texto_limpo)
-    if m:
-        return m.group(1)
-    return ""
+    return seq[-BARCODE_TAIL_LEN:]
+
+# Modelos do nome final por (tem snippet, é repetição): escolhidos sem
+# ramificar a montagem da string
+_NOME_MODELOS = {
+    (False, False): "{benef} - {valor}.pdf",
+    (True, False): "{benef} - {snippet} - {valor}.pdf",
+    (False, True): "{prefixo}{contador} - {benef} - {valor}.pdf",
+    (True, True): "{prefixo}{contador} - {benef} - {snippet} - {valor}.pdf",
+}
 
 def montar_nome(benef, valor, contador, snippet):
     """Monta nome final do arquivo"""
-    benef_safe = sanitize_filename(benef)
-    valor_safe = valor if valor else "VALOR_NAO_ENCONTRADO"
-    base = f"{benef_safe} - {valor_safe}"
-    if snippet:
-        base = f"{benef_safe} - {snippet} - {valor_safe}"
-    if contador > 1:
-        return f"{PIX_PREFIX}{contador} - {base}.pdf"
-    else:
-        return f"{base}.pdf"
+    return _NOME_MODELOS[bool(snippet), contador > 1].format(
+        prefixo=PIX_PREFIX,
+        contador=contador,
+        benef=sanitize_filename(benef),
+        snippet=snippet,
+        valor=valor if valor else "VALOR_NAO_ENCONTRADO",
+    )
+
+# --- PROCESSAMENTO ---
+@lru_cache(maxsize=1024)
+def analisar_texto(texto: str, estrito: bool = False) -> tuple:
+    """Extrai (beneficiário, valor, empresa, snippet, debug) de um texto
+
+    Memoizado pelo próprio texto: comprovantes repetidos (reexportados,
+    pagamentos refeitos) não passam de novo pelos regex.
+    """
+    debug_info = {}
+    # Uma só normalização para layout e beneficiário; valor e empresa usam o
+    # texto original (o padrão de início de linha depende das quebras, e os
+    # aliases de empresa casam com o texto como está na página)
+    normalizado = normalizar_texto(texto)
+    beneficiario = extrair_beneficiario(texto, debug_info, estrito, normalizado)
+    valor = extrair_valor(texto, debug_info)
+    empresa = identificar_empresa(texto)
+
+    snippet = extrair_snippet_barcode(texto)
+
+    return beneficiario, valor, empresa, snippet, tuple(debug_info.items())
+
+def processar_pagina(nome_parte: str, page, doc_nativo=None, indice: int = 0,
+                     estrito: bool = False, pasta_tmp: str = None) -> dict:
+    """Extrai os dados de uma página; não depende de estado compartilhado
+
+    Retorna None se a página não puder ser separada: ela fica fora do lote
+    e as demais seguem normalmente.
+    """
+    try:
+        pdf_tmp = gravar_pagina(page, pasta_tmp)
+    except Exception as e:
+        print(f"⚠️ Erro ao separar PDF ({nome_parte}): {e}")
+        return None
+
+    debug_info = {'arquivo': nome_parte} if DEBUG else {}
+
+    texto = extrair_texto_pagina(page, debug_info, doc_nativo, indice)
+    beneficiario, valor, empresa, snippet, debug_extra = analisar_texto(texto, estrito)
+    debug_info.update(debug_extra)
+
+    return {
+        "source": nome_parte,
+        "debug_info": debug_info,
+        "beneficiario": beneficiario,
+        "valor": valor,
+        "empresa": empresa,
+        "snippet": snippet,
+        "pdf_tmp": pdf_tmp,
+    }
+
+# Cache por processo do último PDF aberto: com chunksize, tarefas vizinhas
+# costumam ser páginas do mesmo arquivo e reaproveitam o mesmo parse.
+_pdf_aberto = {}
+
+def _abrir_pdf(caminho: str):
+    if caminho not in _pdf_aberto:
+        for _, doc_nativo in _pdf_aberto.values():
+            if doc_nativo is not None:
+                doc_nativo.close()
+        _pdf_aberto.clear()
+        paginas = listar_paginas(caminho)
+        _pdf_aberto[caminho] = (paginas, abrir_extrator_nativo(caminho) if paginas else None)
+    return _pdf_aberto[caminho]
+
+def processar_pagina_pdf(caminho: str, indice: int, estrito: bool = False,
+                         pasta_tmp: str = None) -> dict:
+    """Processa uma página de um PDF (executado nos processos do pool)"""
+    try:
+        paginas, doc_nativo = _abrir_pdf(caminho)
+        nome_parte, page = paginas[indice]
+    except Exception as e:
+        print(f"⚠️ Erro ao separar PDF ({os.path.basename(caminho)}, página {indice + 1}): {e}")
+        return None
+    return processar_pagina(nome_parte, page, doc_nativo, indice, estrito, pasta_tmp)
+
+def numerar_partes(partes: list) -> list:
+    """Ordena as páginas e numera as repetições de (empresa, beneficiário, valor)"""
+    contador = defaultdict(int)
+    ordenadas = sorted(partes, key=lambda r: r["source"])
+    for parte in ordenadas:
+        chave = (parte["empresa"], parte["beneficiario"], parte["valor"])
+        contador[chave] += 1
+        parte["cnt"] = contador[chave]
+    return ordenadas
+
+def gravar_zip(fila: queue.Queue, erros: list):
+    """Thread de gravação: passa (arquivo, arcname) da fila para o ZIP_FINAL até receber None"""
+    fim = False
+    try:
+        with zipfile.ZipFile(ZIP_FINAL, "w", zipfile.ZIP_STORED) as zf:
+            while True:
+                item = fila.get()
+                if item is None:
+                    fim = True
+                    break
+                zf.write(*item)
+    except Exception as e:
+        erros.append(e)
+        # Continua esvaziando a fila para o laço principal não travar no put();
+        # se o None já chegou (falha ao fechar o ZIP), não há mais nada a esperar
+        while not fim:
+            fim = fila.get() is None
 
 # --- MAIN ---
 def main():
-    safe_makedirs(PASTA_SAIDA)
-    if os.path.exists(TEMP_PARTS):
-        shutil.rmtree(TEMP_PARTS, ignore_errors=True)
-    safe_makedirs(TEMP_PARTS)
+    estrito = MODO_ESTRITO or "--strict" in sys.argv[1:]
+    if GRAVAR_PASTA_SAIDA:
+        safe_makedirs(PASTA_SAIDA)
 
     arquivos_log = []
     debug_logs = []
-    contador = defaultdict(int)
-    processed_sources = set()
+    nomes_usados = {}  # empresa -> nomes já ocupados (minúsculos: Windows ignora caixa)
 
-    originais = [f for f in os.listdir(PASTA_ENTRADA) if f.lower().endswith(".pdf") and "_part" not in f]
+    with os.scandir(PASTA_ENTRADA) as it:
+        originais = [
+            e.path for e in it
+            if e.name.lower().endswith(".pdf") and "_part" not in e.name and e.is_file()
+        ]
 
     print(f"\n{'='*70}")
     print(f"🔄 PROCESSAMENTO - Renomeação de Comprovantes")
     print(f"{'='*70}\n")
     print(f"📊 {len(originais)} arquivos PDF encontrados\n")
 
-    for arq in originais:
-        caminho = os.path.join(PASTA_ENTRADA, arq)
-        separar_em_partes(caminho, TEMP_PARTS)
-
-    partes = [os.path.join(TEMP_PARTS, f) for f in os.listdir(TEMP_PARTS) if f.lower().endswith(".pdf")]
-    partes.sort()
-
-    print(f"📄 {len(partes)} páginas para processar\n")
-
-    for idx, part_path in enumerate(partes, 1):
-        if part_path in processed_sources or not os.path.exists(part_path):
-            continue
-
-        processed_sources.add(part_path)
-        debug_info = {'arquivo': os.path.basename(part_path)}
-
-        texto = extrair_texto_pdf(part_path, debug_info)
-        beneficiario = extrair_beneficiario(texto, debug_info)
-        valor = extrair_valor(texto, debug_info)
-        empresa = identificar_empresa(texto)
-
-        print(f"[{idx}/{len(partes)}] {os.path.basename(part_path)}")
-        print(f"  👤 Beneficiário: {beneficiario}")
-        if 'benef_metodo' in debug_info:
-            print(f"  ✓ Método: {debug_info['benef_metodo']} (score: {debug_info['benef_score']})")
-        print(f"  💰 Valor: {valor}")
-        print(f"  🏢 Empresa: {empresa}")
-
-        chave = (empresa, beneficiario, valor)
-        contador[chave] += 1
-        cnt = contador[chave]
-
-        snippet = ""
-        if re.search(r"LINHA\s+DIGIT|CODIGO\s+DE\s+BARRAS", texto, re.IGNORECASE):
-            seq = extrair_linha_digitavel(texto)
-            if seq:
-                snippet = seq[-BARCODE_TAIL_LEN:] if len(seq) >= BARCODE_TAIL_LEN else seq
-
-        nome_arquivo = montar_nome(beneficiario, valor, cnt, snippet)
-        pasta_empresa = os.path.join(PASTA_SAIDA, empresa)
-        safe_makedirs(pasta_empresa)
-
-        dest = os.path.join(pasta_empresa, nome_arquivo)
-        sufixo = 1
-        base_no_ext = os.path.splitext(nome_arquivo)[0]
-        while os.path.exists(dest):
-            dest = os.path.join(pasta_empresa, f"{base_no_ext}_{sufixo}.pdf")
-            sufixo += 1
-
-        shutil.copy2(part_path, dest)
-        print(f"  ✅ {nome_arquivo}\n")
-
-        debug_info['nome_final'] = nome_arquivo
-        debug_logs.append(debug_info)
-
-        arquivos_log.append({
-            "source": os.path.basename(part_path),
-            "empresa": empresa,
-            "beneficiario": beneficiario,
-            "valor": valor,
-            "nome_final": os.path.basename(dest)
-        })
+    # Extração (PDF + regex) em paralelo, uma tarefa por página para que um PDF
+    # grande também seja dividido entre os processos; numeração e gravação seguem seriais
+    caminhos, indices = [], []
+    for caminho in originais:
+        total = len(listar_paginas(caminho))
+        caminhos.extend([caminho] * total)
+        indices.extend(range(total))
+
+    # Cada processo grava suas páginas num temporário e devolve só o caminho:
+    # o lote não fica inteiro em memória esperando a numeração. Dentro de
+    # PASTA_SAIDA, o temporário está no mesmo disco e vira o arquivo final com
+    # um simples rename.
+    pasta_base_tmp = PASTA_SAIDA if GRAVAR_PASTA_SAIDA else None
+    with tempfile.TemporaryDirectory(prefix=".partes_", dir=pasta_base_tmp) as pasta_tmp:
+        with ProcessPoolExecutor() as ex:
+            resultados = ex.map(processar_pagina_pdf, caminhos, indices, repeat(estrito),
+                                repeat(pasta_tmp), chunksize=4)
+            # Páginas que falharam na separação já foram avisadas pelo processo
+            partes = [p for p in resultados if p is not None]
+        partes = numerar_partes(partes)
+
+        print(f"📄 {len(partes)} páginas para processar\n")
+
+        # O ZIP é escrito junto com cada página, sem reler a pasta de saída no final,
+        # numa thread própria para sobrepor a gravação do ZIP à da pasta de saída.
+        # PDFs já são comprimidos internamente: ZIP_STORED evita gastar CPU com deflate.
+        if os.path.exists(ZIP_FINAL):
+            os.remove(ZIP_FINAL)
+
+        fila_zip = queue.Queue(maxsize=64)
+        erros_zip = []
+        thread_zip = threading.Thread(target=gravar_zip, args=(fila_zip, erros_zip), daemon=True)
+        thread_zip.start()
+        try:
+            for idx, parte in enumerate(partes, 1):
+                nome_parte = parte["source"]
+                debug_info = parte["debug_info"]
+                beneficiario = parte["beneficiario"]
+                valor = parte["valor"]
+                empresa = parte["empresa"]
+                snippet = parte["snippet"]
+
+                print(f"[{idx}/{len(partes)}] {nome_parte}")
+                print(f"  👤 Beneficiário: {beneficiario}")
+                if 'benef_metodo' in debug_info:
+                    print(f"  ✓ Método: {debug_info['benef_metodo']} (score: {debug_info['benef_score']})")
+                print(f"  💰 Valor: {valor}")
+                print(f"  🏢 Empresa: {empresa}")
+
+                nome_arquivo = montar_nome(beneficiario, valor, parte["cnt"], snippet)
+                pasta_empresa = os.path.join(PASTA_SAIDA, empresa)
+
+                usados = nomes_usados.get(empresa)
+                if usados is None:
+                    # Primeira página da empresa: cria a pasta uma única vez e, com um
+                    # único listdir, preserva arquivos de execuções anteriores
+                    usados = set()
+                    if GRAVAR_PASTA_SAIDA:
+                        safe_makedirs(pasta_empresa)
+                        usados.update(f.lower() for f in os.listdir(pasta_empresa))
+                    nomes_usados[empresa] = usados
+
+                nome_final = nome_arquivo
+                sufixo = 1
+                base_no_ext = os.path.splitext(nome_arquivo)[0]
+                while nome_final.lower() in usados:
+                    nome_final = f"{base_no_ext}_{sufixo}.pdf"
+                    sufixo += 1
+                usados.add(nome_final.lower())
+                dest = os.path.join(pasta_empresa, nome_final)
+
+                origem = parte["pdf_tmp"]
+                if GRAVAR_PASTA_SAIDA:
+                    os.replace(origem, dest)
+                    origem = dest
+                fila_zip.put((origem, f"{empresa}/{nome_final}"))
+                print(f"  ✅ {nome_arquivo}\n")
+
+                if DEBUG:
+                    debug_info['nome_final'] = nome_arquivo
+                    debug_logs.append(debug_info)
+
+                arquivos_log.append({
+                    "source": nome_parte,
+                    "empresa": empresa,
+                    "beneficiario": beneficiario,
+                    "valor": valor,
+                    "nome_final": nome_final
+                })
+        finally:
+            fila_zip.put(None)
+            thread_zip.join()
+        if erros_zip:
+            raise erros_zip[0]
 
     # Gerar logs
-    with open(DEBUG_LOG, "w", encoding="utf-8") as f:
+    if DEBUG:
+        linhas = []
+        sep = f"\n{'='*60}\n"
         for log in debug_logs:
-            f.write(f"\n{'='*60}\n")
-            for k, v in log.items():
-                f.write(f"{k}: {v}\n")
-
-    # Criar ZIP
-    if os.path.exists(ZIP_FINAL):
-        os.remove(ZIP_FINAL)
-
-    with zipfile.ZipFile(ZIP_FINAL, "w", zipfile.ZIP_DEFLATED) as zf:
-        for root, _, files in os.walk(PASTA_SAIDA):
-            for f in files:
-                full = os.path.join(root, f)
-                arc = os.path.relpath(full, PASTA_SAIDA)
-                zf.write(full, arc)
-
-    with open(LOG_CSV, "w", encoding="utf-8") as csvf:
-        csvf.write("source;empresa;beneficiario;valor;nome_final\n")
-        for r in arquivos_log:
-            csvf.write(f"{r['source']};{r['empresa']};{r['beneficiario']};{r['valor']};{r['nome_final']}\n")
-
-    try:
-        shutil.rmtree(TEMP_PARTS, ignore_errors=True)
-    except:
-        pass
+            linhas.append(sep)
+            linhas.extend(f"{k}: {v}\n" for k, v in log.items())
+        # Formato legível mantido; uma única chamada de write para o arquivo todo
+        with open(DEBUG_LOG, "w", encoding="utf-8") as f:
+            f.write("".join(linhas))
+
+    campos = ["source", "empresa", "beneficiario", "valor", "nome_final"]
+    with open(LOG_CSV, "w", encoding="utf-8", newline="") as csvf:
+        w = csv.writer(csvf, delimiter=";", lineterminator="\n")
+        w.writerow(campos)
+        w.writerows([r[c] for c in campos] for r in arquivos_log)
 
     print(f"\n{'='*70}")
     print("✅ CONCLUÍDO!")
     print(f"{'='*70}")
     print(f"📦 ZIP: {ZIP_FINAL}")
     print(f"📋 Log: {LOG_CSV}")
-    print(f"🐛 Debug: {DEBUG_LOG}")
+    if DEBUG:
+        print(f"🐛 Debug: {DEBUG_LOG}")
     print(f"{'='*70}\n")
 
 if __name__ == "__main__":